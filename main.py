@@ -1,9 +1,20 @@
 import os
 import logging
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 import asyncio
-import ccxt
+import socket
+import time
+from collections import deque
+from types import SimpleNamespace
+from dataclasses import dataclass, field
+from enum import Enum, auto
+import numpy as np
+from numba import njit
+import aiohttp
+from aiolimiter import AsyncLimiter
+import ccxt.pro as ccxtpro
+from telegram.error import RetryAfter
 from telegram.ext import Application, CommandHandler
 from dotenv import load_dotenv
 import random
@@ -18,80 +29,399 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize OKX exchange
-exchange = ccxt.okx({
+# Bot configuration, read once at startup. /set_params updates the trading thresholds in place.
+CFG = SimpleNamespace(
+    # Telegram configuration
+    telegram_token=os.getenv('TELEGRAM_TOKEN'),
+    telegram_chat_id=os.getenv('TELEGRAM_CHAT_ID'),
+    message_batch_window=0.5,  # Seconds to collect notifications into one message
+    message_separator="\n---\n",
+    max_message_length=4096,  # Telegram's limit per message
+
+    # Trading parameters (high risk settings)
+    symbol='PI/USDT',
+    base_order_size=0.85,  # Use 85% of available USDT for each trade
+    profit_threshold=0.03,  # 3% profit target
+    stop_loss=0.05,  # 5% stop loss
+    volatility_threshold=0.02,  # 2% price movement to trigger analysis
+    check_interval=60,
+    ticker_max_age=5.0,  # Seconds a cached ticker is trusted before falling back to REST  # Re-run market analysis at least every 60 seconds
+    decision_min_interval=1.0,  # Minimum seconds between trading decisions on price updates
+    max_retry_delay=900,  # Cap for the backoff between repeated error notifications and exit retries (15 minutes)
+    stream_retry_delay=5,  # Seconds before re-subscribing to a failed ticker stream
+    candle_timeframe='5m',
+    candle_history=20,  # Number of candle closes kept for analysis
+    sma_short_period=5,
+    sma_long_period=15,
+
+    # Cooldown timer between trades to prevent overtrading
+    trade_cooldown=300,  # 5 minutes
+
+    # Position state survives restarts through this file (next to main.py unless STATE_PATH is set)
+    state_path=os.getenv('STATE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state.json')),
+
+    # HTTP connection reuse for OKX REST and websocket connections
+    http_keepalive_timeout=60,  # Seconds an idle connection stays in the pool
+    dns_cache_ttl=300,  # Seconds a resolved OKX address is reused
+
+    # App-level REST rate limits. OKX limits each endpoint separately: 20 requests per 2 seconds is
+    # the tightest of ticker, candles and order placement; account balance only allows 10.
+    rest_rate_limit=20,
+    balance_rate_limit=10,
+    rest_rate_period=2.0,
+)
+
+# Initialize OKX exchange; REST calls go through rest_call's limiters instead of ccxt's throttler
+exchange = ccxtpro.okx({
     'apiKey': os.getenv('OKX_API_KEY'),
     'secret': os.getenv('OKX_SECRET'),
     'password': os.getenv('OKX_PASSWORD'),
-    'enableRateLimit': True,
+    'enableRateLimit': False,
 })
-
-# Telegram configuration
-TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
-TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
-
-# Trading parameters (high risk settings)
-SYMBOL = 'PI/USDT'
-BASE_ORDER_SIZE = 0.85  # Use 85% of available USDT for each trade
-PROFIT_THRESHOLD = 0.03  # 3% profit target
-STOP_LOSS = 0.05  # 5% stop loss
-VOLATILITY_THRESHOLD = 0.02  # 2% price movement to trigger analysis
-CHECK_INTERVAL = 60  # Check market every 60 seconds
-
-# Cooldown timer between trades to prevent overtrading
-TRADE_COOLDOWN = 300  # 5 minutes
+rest_limiter = AsyncLimiter(CFG.rest_rate_limit, CFG.rest_rate_period)
+balance_limiter = AsyncLimiter(CFG.balance_rate_limit, CFG.rest_rate_period)
 
 # Jarvis persona responses
-JARVIS_GREETINGS = [
+JARVIS_GREETINGS = (
     "Good day, sir. JARVIS online and monitoring PI crypto markets.",
     "At your service, sir. PI market surveillance initialized.",
     "Booting up crypto trading protocols. Ready when you are, sir.",
     "JARVIS active. PI market analysis systems online."
-]
+)
 
-JARVIS_BUY_MESSAGES = [
+JARVIS_BUY_MESSAGES = (
     "Sir, I've detected a favorable entry point for PI. Executing purchase protocol.",
     "Market conditions for PI appear promising. Buying now, sir.",
     "Opportunity detected. Acquiring PI at what appears to be a discounted rate.",
     "Deploying capital into PI. The risk-reward ratio looks particularly enticing."
-]
+)
 
-JARVIS_SELL_MESSAGES = [
+JARVIS_SELL_MESSAGES = (
     "Sir, profit target achieved. Executing sell order for PI holdings.",
     "PI position has reached optimal exit point. Selling now.",
     "The PI rocket has reached our desired altitude. Parachuting out.",
     "Profit secured, sir. Would you like me to prepare a celebratory beverage?"
-]
+)
 
-JARVIS_STOP_LOSS_MESSAGES = [
+JARVIS_STOP_LOSS_MESSAGES = (
     "Stop loss triggered, sir. Cutting our losses on PI as instructed.",
     "PI is underperforming expectations. Executing stop loss protocol.",
     "Sometimes you win, sometimes you learn, sir. Exiting PI position.",
     "Strategic retreat initiated. PI position liquidated to preserve capital."
-]
+)
 
-JARVIS_ANALYSIS_MESSAGES = [
+JARVIS_MANUAL_SELL_MESSAGES = (
+    "Manual exit confirmed, sir. PI position closed on your command.",
+    "As you wish, sir. Liquidating PI holdings now.",
+    "Override acknowledged. Our PI position has been sold.",
+    "Your call, sir. PI position closed, capital returned to USDT."
+)
+
+JARVIS_ANALYSIS_MESSAGES = (
     "Analyzing PI market patterns. The volatility reminds me of your heart rate during test flights.",
     "Running technical analysis on PI. These market structures are quite fascinating.",
     "Market conditions for PI are changing rapidly. I'm monitoring closely.",
     "PI market assessment in progress. The algorithms are detecting interesting patterns."
-]
+)
+
+_choice = random.choice
+
+
+class Reason(Enum):
+    """Why a position is being sold"""
+    PROFIT = auto()
+    STOP_LOSS = auto()
+    MANUAL = auto()
+
+
+SELL_MESSAGES = {
+    Reason.PROFIT: JARVIS_SELL_MESSAGES,
+    Reason.STOP_LOSS: JARVIS_STOP_LOSS_MESSAGES,
+    Reason.MANUAL: JARVIS_MANUAL_SELL_MESSAGES,
+}
 
-last_trade_time = None
-in_position = False
-entry_price = 0
+
+@dataclass
+class State:
+    """Trading state shared by the trading loop and the command handlers"""
+    in_position: bool = False
+    entry_price: float = 0.0
+    last_trade_time: float | None = None  # time.monotonic() of the last trade
+    take_profit_price: float | None = None  # Exit prices for the open position
+    stop_loss_price: float | None = None
+    exit_failures: int = 0  # Consecutive failed or skipped automatic exits
+    next_exit_attempt: float | None = None  # time.monotonic() before which automatic exits are held off
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)  # Serializes buys and sells
+
+    def set_exit_prices(self):
+        """Precompute the profit target and stop loss prices for the open position"""
+        self.take_profit_price = self.entry_price * (1 + CFG.profit_threshold)
+        self.stop_loss_price = self.entry_price * (1 - CFG.stop_loss)
+
+    def save(self):
+        """Write the position to disk, atomically replacing the previous file"""
+        # Monotonic time is meaningless after a restart, so store the last trade as wall-clock time
+        last_trade_at = None
+        if self.last_trade_time is not None:
+            last_trade_at = time.time() - (time.monotonic() - self.last_trade_time)
+
+        try:
+            tmp_path = f"{CFG.state_path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({
+                    'in_position': self.in_position,
+                    'entry_price': self.entry_price,
+                    'last_trade_at': last_trade_at,
+                }, f)
+            os.replace(tmp_path, CFG.state_path)
+        except OSError as e:
+            logger.error(f"Error saving trade state: {e}")
+            # A restart now would forget this position, so make sure the operator hears about it
+            message_queue.put_nowait(f"Sir, I could not save the trading state to {CFG.state_path}: {e}. "
+                                     f"A restart would lose track of the current position.")
+
+    def load(self):
+        """Restore the position written by save(), if there is one; returns False if the file is unreadable"""
+        if not os.path.exists(CFG.state_path):
+            return True
+
+        try:
+            with open(CFG.state_path) as f:
+                saved = json.load(f)
+
+            in_position = bool(saved['in_position'])
+            entry_price = float(saved['entry_price'])
+            last_trade_at = saved['last_trade_at']
+            if last_trade_at is not None:
+                last_trade_at = float(last_trade_at)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.error(f"Error loading trade state from {CFG.state_path}: {e}")
+            return False
+
+        self.in_position = in_position
+        self.entry_price = entry_price
+        if last_trade_at is not None:
+            self.last_trade_time = time.monotonic() - (time.time() - last_trade_at)
+        if self.in_position:
+            self.set_exit_prices()
+        return True
+
+
+STATE = State()
+
+# Telegram bot shared by notifications and command handlers, set up in main()
+bot = None
+
+# Outgoing notifications, drained by telegram_sender()
+message_queue = asyncio.Queue()
+
+# Event-driven decision timing (time.monotonic())
+last_decision_time = None
+deferred_decision = None  # Task re-evaluating the latest price once the debounce window closes
+last_analysis_time = None
+last_analysis_price = None
+
+# Market data cache, kept up to date by the websocket watchers
+latest_ticker = None
+latest_ticker_time = None  # time.monotonic() when latest_ticker was received
+recent_closes = deque(maxlen=CFG.candle_history)
+last_candle_ts = None
+
+# Running sums over recent_closes, updated incrementally as candles arrive
+sum_short = 0.0  # Last sma_short_period closes
+sum_long = 0.0  # Last sma_long_period closes
+gains_sum = 0.0  # Positive candle-to-candle returns
+losses_sum = 0.0  # Magnitude of negative candle-to-candle returns
+
+
+def format_trade_summary(templates, *rows):
+    """Compose a trade notification from a persona line and the summary rows"""
+    summary = "\n".join(f"🔹 {row}" for row in rows)
+    return f"{_choice(templates)}\n\n📊 Trade Summary:\n{summary}\n\n"
+
+
+def open_exchange_session():
+    """Give the exchange an aiohttp session with long-lived keepalive and cached DNS"""
+    # Must run inside the event loop and before the first request; exchange.close() releases both.
+    # ccxt's open() sets up the loop and SSL context (verify, cafile, include_OS_certificates);
+    # with own_session off it skips creating its own session.
+    exchange.own_session = False
+    exchange.open()
+    exchange.own_session = True
+
+    # Same connector ccxt builds (dual-stack with Happy Eyeballs), plus keepalive and DNS caching
+    exchange.tcp_connector = aiohttp.TCPConnector(
+        ssl=exchange.ssl_context,
+        enable_cleanup_closed=True,
+        family=socket.AF_UNSPEC,
+        happy_eyeballs_delay=0,
+        keepalive_timeout=CFG.http_keepalive_timeout,
+        ttl_dns_cache=CFG.dns_cache_ttl,
+    )
+    exchange.session = aiohttp.ClientSession(connector=exchange.tcp_connector, trust_env=exchange.aiohttp_trust_env)
+
+
+async def rest_call(method, *args, **kwargs):
+    """Run an exchange REST call under its endpoint's app-level rate limit"""
+    limiter = balance_limiter if method.__name__ == 'fetch_balance' else rest_limiter
+    async with limiter:
+        return await method(*args, **kwargs)
 
 
 async def send_telegram_message(message):
-    """Send message to Telegram"""
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
-    await application.bot.send_message(chat_id=TELEGRAM_CHAT_ID, text=message)
+    """Queue message for Telegram without waiting on the API"""
+    message_queue.put_nowait(message)
+
+
+async def deliver_telegram_message(text):
+    """Send one message through the Telegram API, waiting out rate limits"""
+    while True:
+        try:
+            await bot.send_message(chat_id=CFG.telegram_chat_id, text=text)
+            return
+        except RetryAfter as e:
+            # Flood control: wait as long as Telegram asks, then resend instead of dropping the batch
+            delay = e.retry_after
+            if isinstance(delay, timedelta):
+                delay = delay.total_seconds()
+            logger.warning(f"Telegram rate limit hit, resending in {delay}s")
+            await asyncio.sleep(delay)
+        except Exception as e:
+            logger.error(f"Error sending Telegram message: {e}")
+            return
+
+
+async def flush_messages(messages):
+    """Send messages and anything else queued, coalesced; returns True if the shutdown marker was among them"""
+    while not message_queue.empty():
+        messages.append(message_queue.get_nowait())
+
+    # None is the shutdown marker for telegram_sender()
+    stopping = None in messages
+    messages = [message for message in messages if message is not None]
+    if not messages:
+        return stopping
+
+    batch = messages[0]
+    for message in messages[1:]:
+        if len(batch) + len(CFG.message_separator) + len(message) > CFG.max_message_length:
+            await deliver_telegram_message(batch)
+            batch = message
+        else:
+            batch += CFG.message_separator + message
+    await deliver_telegram_message(batch)
+    return stopping
+
+
+async def telegram_sender():
+    """Send queued notifications, coalescing bursts, until a None marker is queued"""
+    while True:
+        messages = [await message_queue.get()]
+        try:
+            await asyncio.sleep(CFG.message_batch_window)
+        finally:
+            # Also runs if cancelled mid-window, so a collected burst is still sent
+            stopping = await flush_messages(messages)
+        if stopping:
+            return
+
+
+def track_return(previous_close, close, sign=1):
+    """Add (sign=1) or remove (sign=-1) a candle-to-candle return from the RSI sums"""
+    global gains_sum, losses_sum
+
+    change = close / previous_close - 1
+    if change > 0:
+        gains_sum += sign * change
+    elif change < 0:
+        losses_sum -= sign * change
+
+
+@njit(cache=True, fastmath=True)
+def indicator_sums(closes, short_period, long_period):
+    """Sum the last short/long closes and the positive/negative returns in one pass"""
+    n = closes.shape[0]
+    short_total = 0.0
+    long_total = 0.0
+    gains = 0.0
+    losses = 0.0
+    for i in range(n):
+        close = closes[i]
+        if i >= n - short_period:
+            short_total += close
+        if i >= n - long_period:
+            long_total += close
+        if i > 0:
+            change = close / closes[i - 1] - 1.0
+            if change > 0.0:
+                gains += change
+            else:
+                losses -= change
+    return short_total, long_total, gains, losses
+
+
+def recompute_sums():
+    """Recompute the running sums from recent_closes, shedding accumulated float drift"""
+    global sum_short, sum_long, gains_sum, losses_sum
+
+    closes = np.fromiter(recent_closes, dtype=np.float64, count=len(recent_closes))
+    sum_short, sum_long, gains_sum, losses_sum = indicator_sums(closes, CFG.sma_short_period, CFG.sma_long_period)
+
+
+def update_closes(candle):
+    """Merge an OHLCV candle into the rolling window of closes"""
+    global last_candle_ts, sum_short, sum_long
+
+    timestamp, close = candle[0], candle[4]
+    if timestamp == last_candle_ts:
+        # Candle still forming, swap its old close out of the running sums
+        previous = recent_closes[-1]
+        if len(recent_closes) > 1:
+            track_return(recent_closes[-2], previous, -1)
+            track_return(recent_closes[-2], close)
+        sum_short += close - previous
+        sum_long += close - previous
+        recent_closes[-1] = close
+    elif last_candle_ts is None or timestamp > last_candle_ts:
+        # New candle, the windows shift so recompute the sums exactly
+        recent_closes.append(close)
+        last_candle_ts = timestamp
+        recompute_sums()
+
+
+async def watch_ohlcv_loop():
+    """Keep the rolling window of candle closes updated from the websocket feed"""
+    while True:
+        try:
+            # Seed (or refresh after a disconnect) with the latest candles from REST, then follow the stream;
+            # update_closes skips candles we already hold and refreshes the forming one
+            candles = await rest_call(exchange.fetch_ohlcv, CFG.symbol, CFG.candle_timeframe, limit=CFG.candle_history)
+            for candle in candles:
+                update_closes(candle)
+
+            while True:
+                for candle in await exchange.watch_ohlcv(CFG.symbol, CFG.candle_timeframe):
+                    update_closes(candle)
+        except Exception as e:
+            logger.error(f"Error watching candles: {e}")
+            await asyncio.sleep(CFG.check_interval)
+
+
+def cache_ticker(ticker):
+    """Store a freshly received ticker for get_market_data"""
+    global latest_ticker, latest_ticker_time
+
+    latest_ticker = ticker
+    latest_ticker_time = time.monotonic()
 
 
 async def get_market_data():
     """Get current market data for PI/USDT"""
     try:
-        ticker = exchange.fetch_ticker(SYMBOL)
+        # Served from the websocket cache; REST when it is empty or stale (e.g. the stream is down)
+        if latest_ticker is None or time.monotonic() - latest_ticker_time > CFG.ticker_max_age:
+            cache_ticker(await rest_call(exchange.fetch_ticker, CFG.symbol))
+        ticker = latest_ticker
         return {
             'price': ticker['last'],
             'volume': ticker['quoteVolume'],
@@ -108,7 +438,7 @@ async def get_market_data():
 async def get_available_balance():
     """Get available USDT balance"""
     try:
-        balance = exchange.fetch_balance()
+        balance = await rest_call(exchange.fetch_balance)
         return balance['USDT']['free']
     except Exception as e:
         logger.error(f"Error fetching balance: {e}")
@@ -122,18 +452,19 @@ async def analyze_market():
     if not market_data:
         return False, 0
 
-    # Get recent candles for analysis
-    try:
-        candles = exchange.fetch_ohlcv(SYMBOL, '5m', limit=20)
+    # Not enough history yet (fresh listing, stale market or feed still seeding) for the long SMA
+    if len(recent_closes) < CFG.sma_long_period:
+        logger.warning(f"Insufficient candles for analysis: {len(recent_closes)}/{CFG.sma_long_period}")
+        return False, market_data['price']
 
-        # Calculate volatility (standard deviation of returns)
-        closes = [candle[4] for candle in candles]
-        returns = [closes[i] / closes[i - 1] - 1 for i in range(1, len(closes))]
-        volatility = sum([abs(r) for r in returns]) / len(returns)
+    # Use the running sums over the cached candle closes for analysis
+    try:
+        # Calculate volatility (mean absolute return)
+        volatility = (gains_sum + losses_sum) / (len(recent_closes) - 1)
 
         # Calculate RSI
-        gains = sum([r for r in returns if r > 0])
-        losses = sum([abs(r) for r in returns if r < 0])
+        gains = gains_sum
+        losses = losses_sum
 
         if losses == 0:
             rsi = 100
@@ -142,8 +473,8 @@ async def analyze_market():
             rsi = 100 - (100 / (1 + rs))
 
         # Simple moving averages
-        sma_short = sum(closes[-5:]) / 5
-        sma_long = sum(closes[-15:]) / 15
+        sma_short = sum_short / CFG.sma_short_period
+        sma_long = sum_long / CFG.sma_long_period
 
         # Calculate risk score (higher = more favorable for buying)
         risk_score = 0
@@ -153,7 +484,7 @@ async def analyze_market():
             risk_score += 3
 
         # Volatility analysis
-        if volatility > VOLATILITY_THRESHOLD:
+        if volatility > CFG.volatility_threshold:
             risk_score += 2
 
         # RSI analysis
@@ -184,53 +515,86 @@ async def analyze_market():
 
 async def buy_pi(current_price):
     """Execute buy order for PI"""
-    global in_position, entry_price, last_trade_time
+    async with STATE.lock:
+        # Position may have changed while waiting for the lock
+        if STATE.in_position:
+            return False
 
-    try:
-        usdt_balance = await get_available_balance()
-        order_size_usdt = usdt_balance * BASE_ORDER_SIZE
+        try:
+            usdt_balance = await get_available_balance()
+            order_size_usdt = usdt_balance * CFG.base_order_size
+
+            if order_size_usdt < 10:  # Minimum trade size
+                await send_telegram_message("Sir, available USDT balance is too low for meaningful trade execution.")
+                return False
+
+            # Calculate amount of PI to buy
+            amount = order_size_usdt / current_price
+
+            # Place market buy order
+            order = await rest_call(exchange.create_market_buy_order, CFG.symbol, amount)
+
+            # Update position status
+            STATE.in_position = True
+            STATE.entry_price = current_price
+            STATE.last_trade_time = time.monotonic()
+            STATE.set_exit_prices()
+            STATE.exit_failures = 0
+            STATE.next_exit_attempt = None
+            STATE.save()
+
+            # Send notification
+            message = format_trade_summary(
+                JARVIS_BUY_MESSAGES,
+                f"Bought: {amount:.4f} PI @ ${current_price:.4f}",
+                f"Total: ${order_size_usdt:.2f} USDT",
+                f"Target: ${STATE.take_profit_price:.4f}",
+                f"Stop Loss: ${STATE.stop_loss_price:.4f}",
+            )
+            message += "Risk assessment: High. But as you say, sir, 'No risk, no reward.'"
 
-        if order_size_usdt < 10:  # Minimum trade size
-            await send_telegram_message("Sir, available USDT balance is too low for meaningful trade execution.")
-            return False
+            await send_telegram_message(message)
+            logger.info(f"Buy order executed: {order}")
+            return True
 
-        # Calculate amount of PI to buy
-        amount = order_size_usdt / current_price
+        except Exception as e:
+            logger.error(f"Error placing buy order: {e}")
+            await send_telegram_message(f"Sir, the buy order failed to execute: {e}")
+            return False
 
-        # Place market buy order
-        order = exchange.create_market_buy_order(SYMBOL, amount)
 
-        # Update position status
-        in_position = True
-        entry_price = current_price
-        last_trade_time = datetime.now()
-
-        # Send notification
-        message = f"{random.choice(JARVIS_BUY_MESSAGES)}\n\n" \
-                  f"📊 Trade Summary:\n" \
-                  f"🔹 Bought: {amount:.4f} PI @ ${current_price:.4f}\n" \
-                  f"🔹 Total: ${order_size_usdt:.2f} USDT\n" \
-                  f"🔹 Target: ${current_price * (1 + PROFIT_THRESHOLD):.4f}\n" \
-                  f"🔹 Stop Loss: ${current_price * (1 - STOP_LOSS):.4f}\n\n" \
-                  f"Risk assessment: High. But as you say, sir, 'No risk, no reward.'"
+async def sell_pi(current_price, reason=Reason.PROFIT):
+    """Execute sell order for PI"""
+    async with STATE.lock:
+        # Position may have changed while waiting for the lock
+        if not STATE.in_position:
+            return False
 
-        await send_telegram_message(message)
-        logger.info(f"Buy order executed: {order}")
-        return True
+        # Automatic exits honour the backoff of a failed one; checked under the lock so
+        # exits queued behind it don't all retry as soon as it fails
+        automatic = reason is not Reason.MANUAL
+        if automatic and STATE.next_exit_attempt is not None and time.monotonic() < STATE.next_exit_attempt:
+            return False
 
-    except Exception as e:
-        logger.error(f"Error placing buy order: {e}")
-        await send_telegram_message(f"Sir, the buy order failed to execute: {e}")
-        return False
+        sold = await place_sell_order(current_price, reason)
 
+        if sold or not STATE.in_position:
+            STATE.exit_failures = 0
+            STATE.next_exit_attempt = None
+        elif automatic:
+            # Exponential backoff, starting at check_interval
+            STATE.exit_failures += 1
+            delay = min(CFG.check_interval * 2 ** (STATE.exit_failures - 1), CFG.max_retry_delay)
+            STATE.next_exit_attempt = time.monotonic() + delay
+            logger.warning(f"Exit failed ({STATE.exit_failures} in a row), retrying in {delay}s")
+        return sold
 
-async def sell_pi(current_price, reason="profit"):
-    """Execute sell order for PI"""
-    global in_position, entry_price, last_trade_time
 
+async def place_sell_order(current_price, reason):
+    """Sell the PI balance and record the exit; the caller holds STATE.lock"""
     try:
         # Get current PI balance
-        balance = exchange.fetch_balance()
+        balance = await rest_call(exchange.fetch_balance)
         pi_amount = balance['PI']['free']
 
         if pi_amount * current_price < 10:  # Minimum trade value
@@ -238,30 +602,27 @@ async def sell_pi(current_price, reason="profit"):
             return False
 
         # Place market sell order
-        order = exchange.create_market_sell_order(SYMBOL, pi_amount)
+        order = await rest_call(exchange.create_market_sell_order, CFG.symbol, pi_amount)
 
         # Calculate profit/loss
-        entry_value = pi_amount * entry_price
+        entry_value = pi_amount * STATE.entry_price
         exit_value = pi_amount * current_price
         profit_loss = exit_value - entry_value
         profit_percent = (profit_loss / entry_value) * 100
 
         # Update position status
-        in_position = False
-        last_trade_time = datetime.now()
-
-        # Select appropriate message based on reason
-        if reason == "profit":
-            message_templates = JARVIS_SELL_MESSAGES
-        else:  # stop loss
-            message_templates = JARVIS_STOP_LOSS_MESSAGES
-
-        # Send notification
-        message = f"{random.choice(message_templates)}\n\n" \
-                  f"📊 Trade Summary:\n" \
-                  f"🔹 Sold: {pi_amount:.4f} PI @ ${current_price:.4f}\n" \
-                  f"🔹 Entry Price: ${entry_price:.4f}\n" \
-                  f"🔹 P/L: ${profit_loss:.2f} ({profit_percent:.2f}%)\n\n"
+        STATE.in_position = False
+        STATE.last_trade_time = time.monotonic()
+        STATE.take_profit_price = STATE.stop_loss_price = None
+        STATE.save()
+
+        # Send notification, worded for the reason we sold
+        message = format_trade_summary(
+            SELL_MESSAGES[reason],
+            f"Sold: {pi_amount:.4f} PI @ ${current_price:.4f}",
+            f"Entry Price: ${STATE.entry_price:.4f}",
+            f"P/L: ${profit_loss:.2f} ({profit_percent:.2f}%)",
+        )
 
         if profit_loss > 0:
             message += "A successful venture, sir. Perhaps this calls for a celebration."
@@ -280,66 +641,133 @@ async def sell_pi(current_price, reason="profit"):
 
 async def check_exit_conditions(current_price):
     """Check if we should exit current position"""
-    if not in_position:
+    if not STATE.in_position:
         return
 
-    profit_percentage = (current_price - entry_price) / entry_price
+    # Hold off after a failed or skipped exit rather than hitting the order endpoint on every tick
+    # (sell_pi checks again under the lock)
+    if STATE.next_exit_attempt is not None and time.monotonic() < STATE.next_exit_attempt:
+        return
 
     # Check profit target
-    if profit_percentage >= PROFIT_THRESHOLD:
-        logger.info(f"Profit target hit: {profit_percentage:.2%}")
-        await sell_pi(current_price, "profit")
+    if current_price >= STATE.take_profit_price:
+        logger.info(f"Profit target hit: {current_price / STATE.entry_price - 1:.2%}")
+        await sell_pi(current_price, Reason.PROFIT)
 
     # Check stop loss
-    elif profit_percentage <= -STOP_LOSS:
-        logger.info(f"Stop loss hit: {profit_percentage:.2%}")
-        await sell_pi(current_price, "stop_loss")
+    elif current_price <= STATE.stop_loss_price:
+        logger.info(f"Stop loss hit: {current_price / STATE.entry_price - 1:.2%}")
+        await sell_pi(current_price, Reason.STOP_LOSS)
 
 
-async def trading_loop():
-    """Main trading loop"""
-    global last_trade_time
+async def handle_price(current_price):
+    """Run the trading decision for a new price update, debounced to decision_min_interval"""
+    global last_decision_time, deferred_decision
 
-    # Send startup message
-    await send_telegram_message(
-        f"{random.choice(JARVIS_GREETINGS)}\n\nMonitoring {SYMBOL} for high-risk opportunities. Safety protocols minimized as requested, sir.")
+    now = time.monotonic()
+    if last_decision_time is not None and now - last_decision_time < CFG.decision_min_interval:
+        # Re-evaluate the latest cached price when the window closes, so a skipped update isn't lost
+        if deferred_decision is None or deferred_decision.done():
+            delay = last_decision_time + CFG.decision_min_interval - now
+            deferred_decision = asyncio.create_task(decide_later(delay))
+        return
+    last_decision_time = now
 
-    while True:
-        try:
-            current_data = await get_market_data()
-            if not current_data:
-                await asyncio.sleep(CHECK_INTERVAL)
-                continue
+    await decide(current_price)
 
-            current_price = current_data['price']
 
-            # First check if we need to exit current position
-            if in_position:
-                await check_exit_conditions(current_price)
+async def decide_later(delay):
+    """Run a decision on the latest cached price after delay seconds"""
+    global deferred_decision
 
-            # Then check if we should enter a new position
-            else:
-                # Ensure cooldown period has passed
-                if last_trade_time and (datetime.now() - last_trade_time).seconds < TRADE_COOLDOWN:
-                    await asyncio.sleep(CHECK_INTERVAL)
-                    continue
+    await asyncio.sleep(delay)
+    deferred_decision = None
+    try:
+        await handle_price(latest_ticker['last'])
+    except Exception as e:
+        logger.error(f"Error in deferred trading decision: {e}")
+
+
+async def decide(current_price):
+    """Exit or enter a position based on the current price"""
+    global last_analysis_time, last_analysis_price
 
-                # Send occasional analysis message
-                if random.random() < 0.3:  # 30% chance of sending analysis message
-                    await send_telegram_message(random.choice(JARVIS_ANALYSIS_MESSAGES))
+    now = time.monotonic()
 
-                # Analyze market for buy signal
-                buy_signal, price = await analyze_market()
-                if buy_signal:
-                    await buy_pi(current_price)
+    # First check if we need to exit current position
+    if STATE.in_position:
+        await check_exit_conditions(current_price)
+        return
+
+    # Then check if we should enter a new position, once the cooldown period has passed
+    if STATE.last_trade_time is not None and now - STATE.last_trade_time < CFG.trade_cooldown:
+        return
 
-            # Sleep before next check
-            await asyncio.sleep(CHECK_INTERVAL)
+    # Only re-analyze on a material price move or after check_interval
+    if last_analysis_time is not None and now - last_analysis_time < CFG.check_interval \
+            and abs(current_price / last_analysis_price - 1) < CFG.volatility_threshold:
+        return
+    last_analysis_time = now
+    last_analysis_price = current_price
+
+    # Send occasional analysis message
+    if random.random() < 0.3:  # 30% chance of sending analysis message
+        await send_telegram_message(_choice(JARVIS_ANALYSIS_MESSAGES))
+
+    # Analyze market for buy signal
+    buy_signal, price = await analyze_market()
+    if buy_signal:
+        await buy_pi(current_price)
+
+
+async def check_exits_over_rest():
+    """Run the exit checks on a REST ticker while the websocket feed is failing"""
+    # Called from trading_loop's error path, so it must not raise
+    try:
+        ticker = await rest_call(exchange.fetch_ticker, CFG.symbol)
+        cache_ticker(ticker)
+        await handle_price(ticker['last'])
+    except Exception as e:
+        logger.error(f"Error checking exits over REST: {e}")
+
+
+async def trading_loop():
+    """Main trading loop, driven by websocket ticker updates"""
+    # Send startup message
+    await send_telegram_message(
+        f"{_choice(JARVIS_GREETINGS)}\n\nMonitoring {CFG.symbol} for high-risk opportunities. Safety protocols minimized as requested, sir.")
+
+    consecutive_failures = 0
+    last_error_signature = None
+    next_error_notice = 0.0
+
+    while True:
+        try:
+            ticker = await exchange.watch_ticker(CFG.symbol)
+            cache_ticker(ticker)
+            await handle_price(ticker['last'])
+            consecutive_failures = 0
+            last_error_signature = None
 
         except Exception as e:
-            logger.error(f"Error in trading loop: {e}")
-            await send_telegram_message(f"Sir, I've encountered an unexpected error: {e}. Trading systems rebooting.")
-            await asyncio.sleep(CHECK_INTERVAL * 2)
+            consecutive_failures += 1
+            logger.error(f"Error in trading loop (failure {consecutive_failures}): {e}")
+
+            # Notify when the error changes; repeats of the same outage back off exponentially with jitter
+            now = time.monotonic()
+            error_signature = type(e).__name__ + str(e)[:80]
+            if error_signature != last_error_signature or now >= next_error_notice:
+                last_error_signature = error_signature
+                notice_delay = min(CFG.check_interval * 2 ** consecutive_failures, CFG.max_retry_delay)
+                next_error_notice = now + notice_delay + random.uniform(0, 5)
+                await send_telegram_message(f"Sir, I've encountered an unexpected error: {e}. Trading systems rebooting.")
+
+            # Keep guarding an open position from REST prices while the stream recovers
+            if STATE.in_position:
+                await check_exits_over_rest()
+
+            # ccxt.pro reconnects on the next watch call, so retry the stream quickly
+            await asyncio.sleep(CFG.stream_retry_delay + random.uniform(0, 1))
 
 
 # Command handlers for manual control
@@ -352,20 +780,19 @@ async def start_command(update, context):
 
 async def status_command(update, context):
     """Show current status"""
-    market_data = await get_market_data()
-    balance = await get_available_balance()
+    market_data, balance = await asyncio.gather(get_market_data(), get_available_balance())
 
     status_message = f"📊 Status Report - {datetime.now().strftime('%H:%M:%S')}\n\n"
     status_message += f"🔹 PI Price: ${market_data['price']:.4f}\n"
     status_message += f"🔹 24h Change: {market_data['change_24h']:.2f}%\n"
     status_message += f"🔹 USDT Balance: ${balance:.2f}\n"
 
-    if in_position:
-        profit_percentage = (market_data['price'] - entry_price) / entry_price * 100
-        status_message += f"🔹 Position: LONG PI @ ${entry_price:.4f}\n"
+    if STATE.in_position:
+        profit_percentage = (market_data['price'] - STATE.entry_price) / STATE.entry_price * 100
+        status_message += f"🔹 Position: LONG PI @ ${STATE.entry_price:.4f}\n"
         status_message += f"🔹 Current P/L: {profit_percentage:.2f}%\n"
-        status_message += f"🔹 Target Exit: ${entry_price * (1 + PROFIT_THRESHOLD):.4f}\n"
-        status_message += f"🔹 Stop Loss: ${entry_price * (1 - STOP_LOSS):.4f}\n"
+        status_message += f"🔹 Target Exit: ${STATE.take_profit_price:.4f}\n"
+        status_message += f"🔹 Stop Loss: ${STATE.stop_loss_price:.4f}\n"
     else:
         status_message += "🔹 Position: No active position\n"
 
@@ -374,9 +801,7 @@ async def status_command(update, context):
 
 async def buy_command(update, context):
     """Manual buy command"""
-    global in_position
-
-    if in_position:
+    if STATE.in_position:
         await update.message.reply_text("Already in position, sir. Perhaps selling first would be prudent?")
         return
 
@@ -387,15 +812,13 @@ async def buy_command(update, context):
 
 async def sell_command(update, context):
     """Manual sell command"""
-    global in_position
-
-    if not in_position:
+    if not STATE.in_position:
         await update.message.reply_text("No position to sell, sir. Perhaps we should acquire some PI first?")
         return
 
     market_data = await get_market_data()
     await update.message.reply_text("Manual sell protocol initiated. Liquidating PI position, sir.")
-    await sell_pi(market_data['price'], "manual")
+    await sell_pi(market_data['price'], Reason.MANUAL)
 
 
 async def set_params_command(update, context):
@@ -410,25 +833,26 @@ async def set_params_command(update, context):
             )
             return
 
-        global BASE_ORDER_SIZE, PROFIT_THRESHOLD, STOP_LOSS
-        BASE_ORDER_SIZE = float(args[0])
-        PROFIT_THRESHOLD = float(args[1])
-        STOP_LOSS = float(args[2])
+        CFG.base_order_size = float(args[0])
+        CFG.profit_threshold = float(args[1])
+        CFG.stop_loss = float(args[2])
+
+        # Apply the new thresholds to an open position too
+        if STATE.in_position:
+            STATE.set_exit_prices()
 
         await update.message.reply_text(
             f"Parameters updated successfully, sir:\n"
-            f"🔹 Order Size: {BASE_ORDER_SIZE * 100}% of USDT\n"
-            f"🔹 Profit Target: {PROFIT_THRESHOLD * 100}%\n"
-            f"🔹 Stop Loss: {STOP_LOSS * 100}%"
+            f"🔹 Order Size: {CFG.base_order_size * 100}% of USDT\n"
+            f"🔹 Profit Target: {CFG.profit_threshold * 100}%\n"
+            f"🔹 Stop Loss: {CFG.stop_loss * 100}%"
         )
     except Exception as e:
         await update.message.reply_text(f"Error updating parameters: {e}")
 
 
-async def setup_telegram_commands():
+async def setup_telegram_commands(application):
     """Set up Telegram command handlers"""
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
-
     # Add command handlers
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("status", status_command))
@@ -437,7 +861,6 @@ async def setup_telegram_commands():
     application.add_handler(CommandHandler("set_params", set_params_command))
 
     # Start the bot
-    await application.initialize()
     await application.start()
     await application.updater.start_polling()
 
@@ -445,14 +868,53 @@ async def setup_telegram_commands():
 # Main function
 async def main():
     """Run the bot"""
+    global bot
+
     # Setup logging
     logging.info("Starting PI trading bot")
 
-    # Run Telegram bot and trading loop concurrently
-    await asyncio.gather(
-        setup_telegram_commands(),
-        trading_loop()
-    )
+    # Resume tracking a position opened before the last restart. Refuse to start on an unreadable
+    # state file: starting flat could leave a held PI position without exit logic.
+    if not STATE.load():
+        logger.critical(f"Not starting: fix or remove {CFG.state_path} after checking the PI balance on OKX")
+        raise SystemExit(1)
+    if STATE.in_position:
+        logger.info(f"Resuming PI position entered @ ${STATE.entry_price:.4f}")
+
+    # Build the Telegram application once and reuse its bot for every notification;
+    # updates are handled concurrently so a command waiting on the exchange doesn't stall the others
+    application = Application.builder().token(CFG.telegram_token).concurrent_updates(True).build()
+    await application.initialize()
+    bot = application.bot
+
+    open_exchange_session()
+
+    # Compile the indicator kernel now rather than on the first candle
+    indicator_sums(np.ones(2), CFG.sma_short_period, CFG.sma_long_period)
+
+    # Run Telegram bot and trading loop concurrently; the sender runs apart so it can be drained on exit
+    sender = asyncio.create_task(telegram_sender())
+    try:
+        await asyncio.gather(
+            setup_telegram_commands(application),
+            watch_ohlcv_loop(),
+            trading_loop()
+        )
+    finally:
+        # Send notifications still queued (e.g. a last sell confirmation) before the bot goes away
+        if sender.done():
+            await flush_messages([])
+        else:
+            message_queue.put_nowait(None)
+            await sender
+
+        # Stop the shared Telegram application, then release the exchange's aiohttp session and websockets
+        if application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await exchange.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,47 @@
+import random
+from collections import deque
+
+import pytest
+
+import main
+
+
+@pytest.fixture(autouse=True)
+def fresh_window(monkeypatch):
+    """Start every test from an empty candle window"""
+    monkeypatch.setattr(main, 'recent_closes', deque(maxlen=main.CFG.candle_history))
+    monkeypatch.setattr(main, 'last_candle_ts', None)
+    for name in ('sum_short', 'sum_long', 'gains_sum', 'losses_sum'):
+        monkeypatch.setattr(main, name, 0.0)
+
+
+def direct_sums(closes):
+    """Recompute the four indicator sums straight from the closes"""
+    returns = [b / a - 1 for a, b in zip(closes, closes[1:])]
+    return (sum(closes[-main.CFG.sma_short_period:]),
+            sum(closes[-main.CFG.sma_long_period:]),
+            sum(r for r in returns if r > 0),
+            -sum(r for r in returns if r < 0))
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_running_sums_match_direct_recompute(seed):
+    rng = random.Random(seed)
+    timestamp = 1_700_000_000_000
+    price = 0.5
+    for _ in range(500):
+        # Mostly updates to the forming candle, sometimes a new one, occasionally a stale replay
+        roll = rng.random()
+        if roll < 0.3:
+            timestamp += 300_000
+        elif roll < 0.35 and main.last_candle_ts is not None:
+            stale = main.last_candle_ts - 300_000
+            main.update_closes([stale, 0, 0, 0, price * 2, 0])
+            continue
+        price *= 1 + rng.uniform(-0.02, 0.02)
+        main.update_closes([timestamp, 0, 0, 0, price, 0])
+
+        closes = list(main.recent_closes)
+        expected = direct_sums(closes)
+        actual = (main.sum_short, main.sum_long, main.gains_sum, main.losses_sum)
+        assert actual == pytest.approx(expected, abs=1e-9)